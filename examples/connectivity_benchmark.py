@@ -0,0 +1,101 @@
+# Benchmark of the partial order reconstruction used for neuron connectivity.
+#
+# The synthetic part builds ``Query.PARTIAL_ORDER`` rows for ever larger
+# trees and shows that reconstruction time grows linearly with their size.
+# With ``--live`` the largest neurons of all connectivity models are also
+# queried and rebuilt from the endpoint.
+
+import argparse
+import time
+
+from npoexplorer.connectivity import partial_order_connectivities
+
+REPEAT = 5
+SIZES = (100, 1000, 10000, 100000)
+LARGEST = 10
+
+def synthetic_rows(size, branching=3):
+    # a tree of ``size`` nodes, every node being a ``[layer region]`` blank node
+    rows, lists = [], [f"list-{n}" for n in range(size)]
+    def cell_rows(n, items):
+        for i, (first, first_type) in enumerate(items):
+            rest = f"cell-{n}-{i + 1}" if i + 1 < len(items) else "rdf:nil"
+            row = {
+                "Neuron_IRI": {"type": "uri", "value": "ilxtr:neuron-type-synthetic"},
+                "List": {"type": "bnode", "value": lists[0]},
+                "Cell": {"type": "bnode", "value": lists[n] if i == 0 else f"cell-{n}-{i}"},
+                "First": {"type": first_type, "value": first},
+                "Rest": {"type": "uri" if rest == "rdf:nil" else "bnode", "value": rest},
+            }
+            if i == 0:
+                row["Layer"] = {"type": "uri", "value": f"ILX:{n}"}
+                row["Region"] = {"type": "uri", "value": f"UBERON:{n}"}
+            rows.append(row)
+    for n in range(size):
+        children = range(n * branching + 1, min(size, (n + 1) * branching + 1))
+        cell_rows(n, [(f"node-{n}", "bnode")] + [(lists[c], "bnode") for c in children])
+    return rows
+
+def best_time(fn, *args):
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def synthetic():
+    print("Synthetic trees:")
+    for size in SIZES:
+        for branching, shape in ((1, "chain"), (3, "tree")):
+            rows = synthetic_rows(size, branching)
+            elapsed = best_time(partial_order_connectivities, rows)
+            print(f"  {shape:5} {size:7} nodes: {elapsed * 1000:9.2f} ms"
+                  f" ({elapsed / size * 1e6:.2f} us/node)")
+
+def live(endpoint):
+    from npoexplorer import NPOExplorer, SPARQLConnection
+    from npoexplorer.query import Namespace, Query
+
+    explorer = NPOExplorer(endpoint=endpoint)
+    neurons = {
+        path["id"]
+        for model in explorer.connectivity_models()
+        for path in explorer.entity_knowledge(model).get("paths", [])
+    }
+    explorer.close()
+
+    conn = SPARQLConnection(endpoint)
+    def query(entities):
+        results = conn.select(Query.PARTIAL_ORDER.format(values=Query.values(entities)))
+        results = results.get("results", {}).get("bindings", [])
+        for rst in results:
+            for v in rst.values():
+                if v["type"] == "uri":
+                    v["value"] = Namespace.curie(v["value"])
+        return results
+
+    sizes = {neuron: len(query([neuron])) for neuron in neurons}
+    largest = sorted(sizes, key=sizes.get, reverse=True)[:LARGEST]
+    print(f"Largest neurons from {endpoint}:")
+    for neuron in largest:
+        start = time.perf_counter()
+        results = query([neuron])
+        queried = time.perf_counter() - start
+        elapsed = best_time(partial_order_connectivities, results)
+        edges = len(partial_order_connectivities(results)[0].get(neuron, []))
+        print(f"  {neuron}: {len(results)} cells, {edges} edges,"
+              f" query {queried * 1000:.1f} ms, rebuild {elapsed * 1000:.2f} ms")
+    conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--live", action="store_true", help="Also benchmark the largest neurons of the endpoint")
+    parser.add_argument("--endpoint", default=None)
+    args = parser.parse_args()
+
+    synthetic()
+    if args.live:
+        from npoexplorer import ENDPOINT_BLAZEGRAPH
+        live(args.endpoint or ENDPOINT_BLAZEGRAPH)
@@ -0,0 +1,49 @@
+# Guard against regressions in ``import npoexplorer`` start-up cost.
+#
+# The package import should stay close to the cost of importing ``requests``
+# and must not pull in the backend specific dependencies (pystardog, rdflib).
+# Exits with a non-zero status when either condition is violated.
+
+import subprocess
+import sys
+
+REPEAT = 7
+MAX_RATIO = 1.5
+MAX_OVERHEAD = 0.05  # seconds
+HEAVY_MODULES = ("stardog", "rdflib")
+
+TIMER = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed)
+print(",".join(m for m in {heavy} if m in sys.modules))
+"""
+
+def import_time(module):
+    best, loaded = None, ""
+    for _ in range(REPEAT):
+        output = subprocess.run(
+            [sys.executable, "-c", TIMER.format(module=module, heavy=HEAVY_MODULES)],
+            capture_output=True, text=True, check=True,
+        ).stdout.splitlines()
+        elapsed = float(output[0])
+        loaded = output[1] if len(output) > 1 else ""
+        best = elapsed if best is None else min(best, elapsed)
+    return best, loaded
+
+if __name__ == "__main__":
+    baseline, _ = import_time("requests")
+    package, loaded = import_time("npoexplorer")
+    print(f"import requests:    {baseline * 1000:.1f} ms")
+    print(f"import npoexplorer: {package * 1000:.1f} ms")
+
+    failed = False
+    if loaded:
+        print(f"FAIL: eagerly imported {loaded}")
+        failed = True
+    if package > baseline * MAX_RATIO + MAX_OVERHEAD:
+        print(f"FAIL: more than {MAX_RATIO}x the cost of importing requests")
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -4,12 +4,23 @@ import ast
 import logging as log
 import os
 import re
+import threading
+import time
 from urllib.parse import urljoin
 
-import rdflib
 import requests
-import stardog
 
+from npoexplorer.backends import (
+    STARDOG_POOL_SIZE,
+    EndpointError,
+    QueryError,
+    circuit_breaker,
+)
+from npoexplorer.connectivity import (
+    EXCLUDED_LAYERS,
+    filter_layer,
+    partial_order_connectivities,
+)
 from npoexplorer.query import Namespace, Query
 
 # ===============================================================================
@@ -20,6 +31,18 @@ NPO_USERNAME = os.environ.get("NPO_USERNAME")
 NPO_PASSWORD = os.environ.get("NPO_PASSWORD")
 DB_NAME = "NPO"
 
+# Stardog and Blazegraph serve the same knowledge so either can stand in
+# for the other during an outage
+FAILOVER_ENDPOINTS = {
+    ENDPOINT_STARDOG: ENDPOINT_BLAZEGRAPH,
+    ENDPOINT_BLAZEGRAPH: ENDPOINT_STARDOG,
+}
+
+# Seconds before cached knowledge is revalidated against the endpoint
+KNOWLEDGE_TTL = 3600
+REFRESH_RETRIES = 3
+REFRESH_BACKOFF = 5     # seconds, doubled after each failed refresh
+
 NPO_OWNER = "SciCrunch"
 NPO_REPO = "NIF-Ontology"
 NPO_BRANCH = "neurons"
@@ -52,74 +75,101 @@ NPO_TO_SCKAN_MODEL = {
     term_npo: term_sckan for term_sckan, term_npo in SCKAN_TO_NPO_MODEL.items()
 }
 
-# Layers shouldn't be resolving to
-# ``spinal cord``, etc. nor to ``None``.
-# A SCKAN issue
-EXCLUDED_LAYERS = (
-    None,
-    'UBERON:0000010',      # peripheral nervous system
-    'UBERON:0000178',      # blood
-    'UBERON:0000468',      # multicellular organism
-    'UBERON:0001017',      # central nervous system
-    'UBERON:0001359',      # cerebrospinal fluid
-    'UBERON:0002318',      # spinal cord white matter
-    'UBERON:0003714',      # neural tissue
-    'UBERON:0005844',      # spinal cord segment
-    'UBERON:0016549',      # cns white matter
-)
-
 # ===============================================================================
 
 __version__ = "0.0.3"
 
 # ===============================================================================
 
-class SPARQLConnection(stardog.Connection):
-    def __init__(self, endpoint=ENDPOINT_BLAZEGRAPH) -> None:
+class SPARQLConnection:
+    def __init__(self, endpoint=ENDPOINT_BLAZEGRAPH, failover=True, pool_size=STARDOG_POOL_SIZE) -> None:
         self.__ep = endpoint
-        if endpoint == ENDPOINT_STARDOG:
-            connection_details = {
-                "endpoint": endpoint,
-                "username": NPO_USERNAME,
-                "password": NPO_PASSWORD,
-            }
-            super().__init__(DB_NAME, **connection_details)
-            super().begin()
+        self.__pool_size = pool_size
+        self.__endpoints = [endpoint]
+        if failover and (failover_ep := FAILOVER_ENDPOINTS.get(endpoint)) is not None:
+            # Stardog can only stand in when credentials are available
+            if failover_ep != ENDPOINT_STARDOG or (
+                NPO_USERNAME is not None and NPO_PASSWORD is not None
+            ):
+                self.__endpoints += [failover_ep]
+        self.__backends = {}
+        self.__lock = threading.Lock()
+
+    def __backend(self, endpoint):
+        # backends are imported here so that pystardog is only loaded
+        # when the Stardog endpoint is actually selected
+        with self.__lock:
+            if endpoint not in self.__backends:
+                if endpoint == ENDPOINT_STARDOG:
+                    from npoexplorer.backends.stardog import StardogConnectionPool
+
+                    self.__backends[endpoint] = StardogConnectionPool(
+                        endpoint, DB_NAME, NPO_USERNAME, NPO_PASSWORD,
+                        size=self.__pool_size,
+                    )
+                else:
+                    from npoexplorer.backends.blazegraph import BlazegraphConnection
+
+                    self.__backends[endpoint] = BlazegraphConnection(endpoint)
+            return self.__backends[endpoint]
 
     def select(self, query):
-        if self.__ep == ENDPOINT_STARDOG:
-            return super().select(query)
-        elif self.__ep == ENDPOINT_BLAZEGRAPH:
-            headers = {
-                "Accept": "application/sparql-results+json",  # Set the desired response format
-            }
-            params = {
-                "query": query,
-            }
-            response = requests.get(
-                self.__ep, headers=headers, params=params, timeout=10)
-            if response.status_code == 200:
-                return response.json()
-            else:
-                return {}
+        errors = []
+        for endpoint in self.__endpoints:
+            breaker = circuit_breaker(endpoint)
+            if not breaker.allow():
+                errors += [f"{endpoint}: circuit open"]
+                continue
+            try:
+                data = self.__backend(endpoint).select(query)
+            except EndpointError as e:
+                breaker.record_failure()
+                log.warning(f"Query failed on {endpoint}: {e}")
+                errors += [str(e)]
+                continue
+            except QueryError:
+                # the endpoint answered, the request itself was rejected
+                breaker.record_success()
+                raise
+            except Exception:
+                # any other error still ends a half-open trial
+                breaker.record_failure()
+                raise
+            breaker.record_success()
+            if endpoint != self.__ep:
+                log.warning(f"{self.__ep} unavailable, answered by {endpoint}")
+            return data
+        raise EndpointError("; ".join(errors))
 
     def close(self):
-        if self.__ep == ENDPOINT_STARDOG:
-            super().close()
+        with self.__lock:
+            for backend in self.__backends.values():
+                backend.close()
+            self.__backends = {}
 
 # ===============================================================================
 
 
 class NPOExplorer:
-    def __init__(self, allow_loop=False, endpoint=ENDPOINT_STARDOG) -> None:
-        self.__conn = SPARQLConnection(endpoint)
+    def __init__(self, allow_loop=False, endpoint=ENDPOINT_STARDOG, knowledge_ttl=KNOWLEDGE_TTL,
+                 pool_size=STARDOG_POOL_SIZE) -> None:
+        self.__conn = SPARQLConnection(endpoint, pool_size=pool_size)
         self.__connectivity_models = self.__get_connectivity_models()
+        # labels are also written by background refreshes
         self.__labels = {}
+        self.__labels_lock = threading.Lock()
+        self.__allow_loop = allow_loop
         # self.__load_npo_as_graph()
-        self.__load_npo_apinat_connectivities(allow_loop)
-        self.__load_npo_nlp_connectivities()
+        # partial orders are queried per neuron, the NPO repository and NLP
+        # partial orders are only loaded when a neuron has none in the endpoint
+        self.__connectivities = None
+        self.__connectivities_lock = threading.Lock()
 
+        # entity -> (knowledge, time fetched)
         self.__knowledge = {}
+        self.__knowledge_ttl = knowledge_ttl
+        self.__knowledge_lock = threading.Lock()
+        self.__refreshing = set()
 
         _, db_version = self.__select(Query.DB_VERSION)
         self.__metadata = {
@@ -132,20 +182,24 @@ class NPOExplorer:
             f"NPO Explorer version {__version__} using {s_sckan_term} and {npo_term}"
         )
 
-    def __load_npo_apinat_connectivities(self, allow_loop):
+    def __load_npo_apinat_connectivities(self, connectivities_map, allow_loop):
         # loading partial connectivities from NPO repository
         # due to unvailability in stardog
+        # raising keeps the fallback map unset, so loading is retried later
         url = f'{NPO_SOURCE}{NPO_DIR}/{NPO_FILES["PARTIAL_ORDER"]}'
         try:
             response = requests.get(url, timeout=10)
-            if response.status_code == 200:
-                partial_order_text = response.text
-            else:
-                log.error(
-                    f'Failed to load {NPO_FILES["PARTIAL_ORDER"]}. Status code: {response.status_code}'
-                )
         except requests.exceptions.RequestException as e:
-            print(f"An error occurred while fetching the file: {e}")
+            log.error(f"An error occurred while fetching the file: {e}")
+            raise EndpointError(f'Failed to load {NPO_FILES["PARTIAL_ORDER"]}: {e}') from e
+        if response.status_code != 200:
+            log.error(
+                f'Failed to load {NPO_FILES["PARTIAL_ORDER"]}. Status code: {response.status_code}'
+            )
+            raise EndpointError(
+                f'Failed to load {NPO_FILES["PARTIAL_ORDER"]}: status code {response.status_code}'
+            )
+        partial_order_text = response.text
 
         # functions to parse connectivities
         def parse_connectivities(connectivities, sub_structure, root="blank"):
@@ -164,26 +218,6 @@ class NPOExplorer:
                 if len(sub_sub) > 1:
                     parse_connectivities(connectivities, sub_sub[1:], adj)
 
-        # function to filter layer terms, returning filtered_edge
-        def filter_layer(connectivity):
-            edge = []
-            for node in connectivity:
-                new_node = []
-                for terms in node:
-                    if isinstance(terms, tuple):
-                        terms = [t for t in terms if t not in EXCLUDED_LAYERS]
-                        new_node += [tuple(terms)]
-                    else:
-                        terms = terms if terms not in EXCLUDED_LAYERS else []
-                        new_node += [terms]
-                if len(new_node[0]) == 0 and len(new_node[1]) == 0:
-                    return []
-                elif len(new_node[0]) == 0:
-                    new_node = [new_node[1][0], tuple(list(new_node[1])[1:])]
-                edge += [tuple(new_node)]
-            return tuple(edge)
-
-        self.__connectivities = {}
         for partial_order in partial_order_text.split("\n\n"):
             if "neuronPartialOrder" in partial_order:
                 neuron, nested_structure = partial_order.split(
@@ -231,10 +265,22 @@ class NPOExplorer:
                     if len(edge) > 0:
                         if edge[0] != edge[1]:
                             filtered_connectivities += [edge]
-                self.__connectivities[neuron.strip()] = filtered_connectivities
-
-    def __load_npo_nlp_connectivities(self):
+                connectivities_map[neuron.strip()] = filtered_connectivities
+
+    def __fallback_connectivities(self):
+        with self.__connectivities_lock:
+            if self.__connectivities is None:
+                # only keep the maps once both loaders have succeeded, so a
+                # failed download or endpoint query is retried on the next call
+                connectivities_map = {}
+                self.__load_npo_apinat_connectivities(connectivities_map, self.__allow_loop)
+                self.__load_npo_nlp_connectivities(connectivities_map)
+                self.__connectivities = connectivities_map
+            return self.__connectivities
+
+    def __load_npo_nlp_connectivities(self, connectivities_map):
         _, results = self.__select(Query.NPO_PARTIAL_ORDER)
+        labels = {}
         for rst in results:
             neuron_IRI = rst["Neuron_IRI"]["value"]
             neuron_label = rst.get("Neuron_Label", {}).get("value", "")
@@ -243,16 +289,19 @@ class NPOExplorer:
             v2 = rst.get("V2", {}).get("value", "")
             v2_label = rst.get("V2_Label", {}).get("value", "")
             if v1 != "" or v2 != "":
-                if neuron_IRI not in self.__connectivities:
-                    self.__connectivities[neuron_IRI] = []
-                self.__connectivities[neuron_IRI] += [((v1, ()), (v2, ()))]
-                self.__labels[v1] = v1_label
-                self.__labels[v2] = v2_label
-                self.__labels[neuron_IRI] = neuron_label
+                if neuron_IRI not in connectivities_map:
+                    connectivities_map[neuron_IRI] = []
+                connectivities_map[neuron_IRI] += [((v1, ()), (v2, ()))]
+                labels[v1] = v1_label
+                labels[v2] = v2_label
+                labels[neuron_IRI] = neuron_label
+        self.__update_labels(labels)
 
     def __load_npo_as_graph(self):
         # this function is prepared to generate npo graph
         # the graph will be useful when the needed information is not available in stardog
+        import rdflib
+
         self.__graph = rdflib.Graph()
         for ttl_file in NPO_FILES.values():
             try:
@@ -263,8 +312,14 @@ class NPOExplorer:
         from rdflib.namespace import Namespace
 
         rdfs = Namespace(Namespace.namespaces["rdfs"])
-        for subject, obj in self.__graph.subject_objects(rdfs.label):
-            self.__labels[Namespace.curie(str(subject))] = str(obj)
+        self.__update_labels({
+            Namespace.curie(str(subject)): str(obj)
+            for subject, obj in self.__graph.subject_objects(rdfs.label)
+        })
+
+    def __update_labels(self, labels):
+        with self.__labels_lock:
+            self.__labels.update(labels)
 
     def __select(self, query):
         data = self.__conn.select(query)
@@ -301,111 +356,47 @@ class NPOExplorer:
             "references": list(references),
         }
 
-    def __get_neuron_connectivities(self, entity):
-        # this function should be a standard method to get partial connectivity from stardog
-        # currently is not used
-        query = Query.CONNECTIVITY.format(entity=entity)
+    def __get_neurons_connectivities(self, entities):
+        query = Query.PARTIAL_ORDER.format(values=Query.values(entities))
         _, results = self.__select(query)
-        connectivities = []
-        if len(results) > 0:
-            self.__labels[results[0]["Region"]["value"]] = (
-                results[0]["Region_Label"]["value"]
-                if "Region_Label" in results[0]
-                else ""
-            )
-            self.__labels[results[0]["Layer"]["value"]] = (
-                results[0]["Layer_Label"]["value"]
-                if "Layer_Label" in results[0]
-                else ""
-            )
-
-            for idx in range(1, len(results)):
-                prev_count = int(results[idx - 1]["Count"]["value"])
-                count = int(results[idx]["Count"]["value"])
-                if count > prev_count:
-                    prev_layer = results[idx - 1]["Layer"]["value"]
-                    prev_region = results[idx - 1]["Region"]["value"]
-                    layer = results[idx]["Layer"]["value"]
-                    region = results[idx]["Region"]["value"]
-                    connectivities += [
-                        (
-                            (
-                                prev_region,
-                                (prev_layer,)
-                                if "UBERON:" in prev_layer or "ILX:" in prev_layer
-                                else (),
-                            ),
-                            (
-                                region,
-                                (layer,)
-                                if "UBERON:" in layer or "ILX:" in layer
-                                else (),
-                            ),
-                        )
-                    ]
-                else:
-                    prev_idx = idx - 1
-                    prev_count = int(results[prev_idx]["Count"]["value"])
-                    while prev_count >= count:
-                        prev_idx = prev_idx - 1
-                        prev_count = int(results[prev_idx]["Count"]["value"])
-                    if prev_idx <= 0:
-                        continue
-                    else:
-                        prev_idx -= 1
-                        prev_layer = results[prev_idx]["Layer"]["value"]
-                        prev_region = results[prev_idx]["Region"]["value"]
-                        layer = results[idx]["Layer"]["value"]
-                        region = results[idx]["Region"]["value"]
-                        connectivities += [
-                            (
-                                (
-                                    prev_region,
-                                    (prev_layer,)
-                                    if "UBERON:" in prev_layer or "ILX:" in prev_layer
-                                    else (),
-                                ),
-                                (
-                                    region,
-                                    (layer,)
-                                    if "UBERON:" in layer or "ILX:" in layer
-                                    else (),
-                                ),
-                            )
-                        ]
-
-                self.__labels[results[idx]["Region"]["value"]] = (
-                    results[idx]["Region_Label"]["value"]
-                    if "Region_Label" in results[idx]
-                    else ""
-                )
-                self.__labels[results[idx]["Layer"]["value"]] = (
-                    results[idx]["Layer_Label"]["value"]
-                    if "Layer_Label" in results[idx]
-                    else ""
-                )
-
+        connectivities, labels = partial_order_connectivities(
+            results, self.__allow_loop
+        )
+        self.__update_labels(labels)
+        if any(len(connectivities.get(entity, [])) == 0 for entity in entities):
+            fallback = self.__fallback_connectivities()
+            for entity in entities:
+                if len(connectivities.get(entity, [])) == 0:
+                    connectivities[entity] = fallback.get(entity, [])
         return connectivities
 
-    def __get_connectivity_terms(self, entity):
-        query = Query.CONNECTIVITY.format(entity=entity)
+    def __get_neuron_knowledge(self, entity):
+        return self.__get_neurons_knowledge([entity])[entity]
+
+    def __get_neurons_knowledge(self, entities):
+        # a single query retrieves the knowledge of all entities
+        query = Query.NEURON.format(values=Query.values(entities))
         _, results = self.__select(query)
+        neuron_results = {entity: [] for entity in entities}
         for rst in results:
-            if "Region" in rst:
-                if rst["Region"]["type"] == "uri":
-                    self.__labels[rst["Region"]["value"]] = (
-                        rst["Region_Label"]["value"] if "Region_Label" in rst else ""
-                    )
-            if "Layer" in rst:
-                if rst["Layer"]["type"] == "uri":
-                    self.__labels[rst["Layer"]["value"]] = (
-                        rst["Layer_Label"]["value"] if "Layer_Label" in rst else ""
-                    )
+            if rst["Neuron_IRI"]["value"] in neuron_results:
+                neuron_results[rst["Neuron_IRI"]["value"]] += [rst]
 
-    def __get_neuron_knowledge(self, entity):
-        query = Query.NEURON.format(entity=entity)
-        _, results = self.__select(query)
+        # get connectivities, together with the labels of their terms
+        found = [
+            entity for entity in entities
+            if Namespace.is_curie(entity) and len(neuron_results[entity]) > 0
+        ]
+        connectivities = self.__get_neurons_connectivities(found) if len(found) > 0 else {}
 
+        return {
+            entity: self.__parse_neuron_knowledge(
+                entity, neuron_results[entity], connectivities.get(entity, [])
+            )
+            for entity in entities
+        }
+
+    def __parse_neuron_knowledge(self, entity, results, connectivities):
         if len(results) == 0:
             return {"id": entity, "label": entity}
 
@@ -426,7 +417,7 @@ class NPOExplorer:
                 ]
             return combines
 
-        somas, axons, dendrites, vias = {}, {}, {}, {}
+        somas, axons, dendrites, vias, labels = {}, {}, {}, {}, {}
         phenotypes, references, taxons, long_label = [], [], [], ""
         for rst in results:
             # get soma
@@ -459,7 +450,7 @@ class NPOExplorer:
                 long_label = rst["Object"]["value"]
             # get all labels
             if "Object" in rst and rst["Object"]["type"] == "uri":
-                self.__labels[rst["Object"]["value"]] = (
+                labels[rst["Object"]["value"]] = (
                     rst["Object_Label"]["value"] if "Object_Label" in rst else ""
                 )
             # if 'Region' in rst and rst['Region']['type']=='uri':
@@ -468,20 +459,14 @@ class NPOExplorer:
             #     self.__labels[rst['Layer']['value']] = rst['Layer_Label']['value'] if 'Layer_Label' in rst else ''
 
         # set neuron label
-        self.__labels[entity] = long_label
+        labels[entity] = long_label
+        self.__update_labels(labels)
 
         # map connectivity
         somas = combine_layer_regions(somas)
         axons = combine_layer_regions(axons)
         dendrites = combine_layer_regions(dendrites)
 
-        # connectivities = self.__get_neuron_connectivities(entity)
-        connectivities = self.__connectivities.get(entity, [])
-
-        # get required connectivity terms
-        if Namespace.is_curie(entity):
-            self.__get_connectivity_terms(entity)
-
         return {
             "soma": somas,
             "axons": axons,
@@ -499,35 +484,96 @@ class NPOExplorer:
     def connectivity_models(self):
         return self.__connectivity_models
 
+    def __fetch_knowledge(self, entity):
+        if entity in self.__connectivity_models:
+            knowledge = self.__get_model_knowledge(entity)
+        else:
+            knowledge = self.__get_neuron_knowledge(entity)
+        with self.__knowledge_lock:
+            self.__knowledge[entity] = (knowledge, time.monotonic())
+        return knowledge
+
+    def __revalidate_knowledge(self, entity):
+        try:
+            for attempt in range(REFRESH_RETRIES):
+                try:
+                    self.__fetch_knowledge(entity)
+                    return
+                except QueryError as e:
+                    log.error(f"Cannot refresh {entity}: {e}")
+                    return
+                except EndpointError as e:
+                    log.warning(f"Cannot refresh {entity}: {e}")
+                    if attempt + 1 < REFRESH_RETRIES:
+                        time.sleep(REFRESH_BACKOFF * 2**attempt)
+        finally:
+            with self.__knowledge_lock:
+                self.__refreshing.discard(entity)
+
+    def __refresh_knowledge(self, entity):
+        with self.__knowledge_lock:
+            if entity in self.__refreshing:
+                return
+            self.__refreshing.add(entity)
+        threading.Thread(
+            target=self.__revalidate_knowledge, args=(entity,), daemon=True
+        ).start()
+
     def entity_knowledge(self, entity):
         # check entity url, when using scicrunch this can be different
         if entity in SCKAN_TO_NPO_MODEL:
             entity = SCKAN_TO_NPO_MODEL[entity]
         entity = Namespace.curie(entity)
 
-        # if entity is in __knowledge then retrieve from __knowledge
-        if entity in self.__knowledge:
-            return self.__knowledge.get(entity)
+        # check if entity in curie form or not
+        if not Namespace.is_curie(entity):
+            return {"id": entity, "label": entity, "stale": False}
+
+        # if entity is in __knowledge then retrieve from __knowledge,
+        # serving it stale while a background refresh revalidates it
+        with self.__knowledge_lock:
+            cached = self.__knowledge.get(entity)
+        if cached is not None:
+            knowledge, fetched = cached
+            if time.monotonic() - fetched < self.__knowledge_ttl:
+                return dict(knowledge, stale=False)
+            self.__refresh_knowledge(entity)
+            return dict(knowledge, stale=True)
 
         # if not, retrive from endpoint
-        # check if entity in curie form or not
-        if Namespace.is_curie(entity):
-            if entity in self.__connectivity_models:
-                self.__knowledge[entity] = self.__get_model_knowledge(entity)
-                return self.__knowledge[entity]
-            else:
-                self.__knowledge[entity] = self.__get_neuron_knowledge(entity)
-                return self.__knowledge[entity]
-        else:
-            return {"id":entity, "label": entity}
+        try:
+            knowledge = self.__fetch_knowledge(entity)
+        except (EndpointError, QueryError) as e:
+            log.error(f"Cannot retrieve knowledge of {entity}: {e}")
+            return {"id": entity, "label": entity, "errors": [str(e)], "stale": False}
+        return dict(knowledge, stale=False)
+
+    def entities_knowledge(self, entities):
+        # retrieve knowledge of many neurons in one round trip, bypassing
+        # the knowledge cache so that bulk reads use bounded memory
+        entities = [
+            Namespace.curie(SCKAN_TO_NPO_MODEL.get(entity, entity))
+            for entity in entities
+        ]
+        neurons = [
+            entity for entity in entities
+            if Namespace.is_curie(entity) and entity not in self.__connectivity_models
+        ]
+        knowledge = self.__get_neurons_knowledge(neurons) if len(neurons) > 0 else {}
+        return {
+            entity: dict(knowledge[entity], stale=False)
+            if entity in knowledge else self.entity_knowledge(entity)
+            for entity in entities
+        }
 
     def labels(self):
-        return self.__labels
+        # a copy, as background refreshes may add labels while it is used
+        with self.__labels_lock:
+            return dict(self.__labels)
 
     def label(self, entity):
-        if entity in self.__labels:
-            return self.__labels[entity]
-        return ""
+        with self.__labels_lock:
+            return self.__labels.get(entity, "")
 
     def metadata(self, name=None):
         if name is None:
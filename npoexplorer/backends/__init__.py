@@ -0,0 +1,101 @@
+# ===============================================================================
+#
+# Endpoint specific connections. Each backend is imported on demand by
+# ``SPARQLConnection`` so that its dependencies are only loaded when the
+# corresponding endpoint is selected.
+#
+# ===============================================================================
+
+import threading
+import time
+
+# ===============================================================================
+
+FAILURE_THRESHOLD = 3   # consecutive failures before the circuit opens
+RESET_TIMEOUT = 30      # seconds an open circuit waits before a trial call
+STARDOG_POOL_SIZE = 4   # concurrent connections to Stardog
+
+# ===============================================================================
+
+
+class EndpointError(Exception):
+    pass
+
+
+class QueryError(Exception):
+    # the endpoint rejected the request itself (a 4xx response), so neither
+    # the circuit breaker nor failover should react to it
+    pass
+
+
+def is_endpoint_failure(status_code):
+    # timeouts and throttling are failures of the endpoint, as are 5xx
+    return status_code is None or status_code >= 500 or status_code in (408, 429)
+
+# ===============================================================================
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT) -> None:
+        self.__failure_threshold = failure_threshold
+        self.__reset_timeout = reset_timeout
+        self.__failures = 0
+        self.__opened_at = None
+        self.__trial = False
+        self.__lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.__lock:
+            return self.__state()
+
+    def __state(self):
+        if self.__opened_at is None:
+            return CircuitBreaker.CLOSED
+        if time.monotonic() - self.__opened_at >= self.__reset_timeout:
+            return CircuitBreaker.HALF_OPEN
+        return CircuitBreaker.OPEN
+
+    def allow(self):
+        # an open circuit fails fast; once the reset timeout has passed a
+        # single trial call is let through to probe the endpoint
+        with self.__lock:
+            state = self.__state()
+            if state == CircuitBreaker.CLOSED:
+                return True
+            if state == CircuitBreaker.HALF_OPEN and not self.__trial:
+                self.__trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.__lock:
+            self.__failures = 0
+            self.__opened_at = None
+            self.__trial = False
+
+    def record_failure(self):
+        with self.__lock:
+            self.__failures += 1
+            if self.__trial or self.__failures >= self.__failure_threshold:
+                self.__opened_at = time.monotonic()
+            self.__trial = False
+
+# ===============================================================================
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def circuit_breaker(endpoint):
+    # breakers are shared per endpoint, so all connections to an endpoint
+    # see the same outage
+    with _breakers_lock:
+        if endpoint not in _breakers:
+            _breakers[endpoint] = CircuitBreaker()
+        return _breakers[endpoint]
+
+# ===============================================================================
@@ -0,0 +1,39 @@
+# ===============================================================================
+
+import requests
+
+from npoexplorer.backends import EndpointError, QueryError, is_endpoint_failure
+
+# ===============================================================================
+
+
+class BlazegraphConnection:
+    def __init__(self, endpoint, timeout=10) -> None:
+        self.__ep = endpoint
+        self.__timeout = timeout
+
+    def select(self, query):
+        headers = {
+            "Accept": "application/sparql-results+json",  # Set the desired response format
+        }
+        data = {
+            "query": query,
+        }
+        try:
+            # POST with a form body, as batched queries are too long for a URL
+            response = requests.post(
+                self.__ep, headers=headers, data=data, timeout=self.__timeout)
+            if response.status_code == 200:
+                return response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            # ValueError covers a 200 response whose body is not JSON
+            raise EndpointError(f"{self.__ep}: {e}") from e
+        if is_endpoint_failure(response.status_code):
+            raise EndpointError(f"{self.__ep}: status code {response.status_code}")
+        raise QueryError(f"{self.__ep}: status code {response.status_code}")
+
+    def close(self):
+        pass
+
+
+# ===============================================================================
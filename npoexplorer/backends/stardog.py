@@ -0,0 +1,162 @@
+# ===============================================================================
+
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+import stardog
+from stardog.exceptions import StardogException
+
+from npoexplorer.backends import (
+    STARDOG_POOL_SIZE,
+    EndpointError,
+    QueryError,
+    is_endpoint_failure,
+)
+
+# ===============================================================================
+
+ACQUIRE_TIMEOUT = 10        # seconds to wait for a free connection
+QUERY_TIMEOUT = 10          # seconds before a query is abandoned
+IDLE_TIMEOUT = 300          # seconds before an idle connection is recycled
+HEALTH_CHECK_INTERVAL = 30  # seconds idle before a connection is checked on reuse
+HEALTH_CHECK_QUERY = "ASK {}"
+
+STARDOG_ERRORS = (StardogException, requests.exceptions.RequestException)
+
+# ===============================================================================
+
+
+class _TimeoutSession(requests.Session):
+    # pystardog sends requests without a timeout, so a hung server would
+    # block the calling thread and keep its pool slot forever
+    def __init__(self, timeout) -> None:
+        super().__init__()
+        self.__timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault("timeout", self.__timeout)
+        return super().request(*args, **kwargs)
+
+# ===============================================================================
+
+
+class StardogConnectionPool:
+    # Read only queries don't need a transaction, so pooled connections
+    # are used directly. Each connection is used by one thread at a time.
+
+    def __init__(self, endpoint, database, username, password,
+                 size=STARDOG_POOL_SIZE, idle_timeout=IDLE_TIMEOUT,
+                 acquire_timeout=ACQUIRE_TIMEOUT, query_timeout=QUERY_TIMEOUT) -> None:
+        self.__ep = endpoint
+        self.__connection_details = {
+            "endpoint": endpoint,
+            "username": username,
+            "password": password,
+        }
+        self.__database = database
+        self.__idle_timeout = idle_timeout
+        self.__acquire_timeout = acquire_timeout
+        self.__query_timeout = query_timeout
+        self.__slots = threading.BoundedSemaphore(size)
+        self.__lock = threading.Lock()
+        self.__idle = []    # (connection, time released), most recent last
+        self.__closed = False
+
+    def __connect(self):
+        try:
+            return stardog.Connection(
+                self.__database,
+                session=_TimeoutSession(self.__query_timeout),
+                **self.__connection_details,
+            )
+        except STARDOG_ERRORS as e:
+            raise EndpointError(f"{self.__ep}: {e}") from e
+
+    def __discard(self, conn):
+        try:
+            conn.close()
+        except STARDOG_ERRORS:
+            pass
+
+    def __healthy(self, conn):
+        try:
+            conn.ask(HEALTH_CHECK_QUERY)
+            return True
+        except STARDOG_ERRORS:
+            return False
+
+    def __checkout(self):
+        while True:
+            with self.__lock:
+                if self.__closed:
+                    raise EndpointError(f"{self.__ep}: connection pool is closed")
+                if len(self.__idle) == 0:
+                    break
+                conn, released = self.__idle.pop()
+            idle = time.monotonic() - released
+            if idle >= self.__idle_timeout:
+                self.__discard(conn)
+            elif idle < HEALTH_CHECK_INTERVAL or self.__healthy(conn):
+                return conn
+            else:
+                self.__discard(conn)
+        return self.__connect()
+
+    def __checkin(self, conn):
+        now = time.monotonic()
+        with self.__lock:
+            if self.__closed:
+                expired, conn = [conn], None
+            else:
+                # recycle connections that have been idle for too long
+                expired = [c for c, released in self.__idle if now - released >= self.__idle_timeout]
+                self.__idle = [
+                    (c, released) for c, released in self.__idle
+                    if now - released < self.__idle_timeout
+                ]
+                self.__idle += [(conn, now)]
+        for c in expired:
+            self.__discard(c)
+
+    @contextmanager
+    def connection(self):
+        if not self.__slots.acquire(timeout=self.__acquire_timeout):
+            raise EndpointError(f"{self.__ep}: no free connection after {self.__acquire_timeout}s")
+        conn = None
+        try:
+            conn = self.__checkout()
+            yield conn
+        except STARDOG_ERRORS:
+            # a connection that failed is not returned to the pool
+            if conn is not None:
+                self.__discard(conn)
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                self.__checkin(conn)
+            self.__slots.release()
+
+    def select(self, query):
+        try:
+            with self.connection() as conn:
+                # the server side timeout is in milliseconds
+                return conn.select(query, timeout=int(self.__query_timeout * 1000))
+        except StardogException as e:
+            if is_endpoint_failure(e.http_code):
+                raise EndpointError(f"{self.__ep}: {e}") from e
+            raise QueryError(f"{self.__ep}: {e}") from e
+        except requests.exceptions.RequestException as e:
+            raise EndpointError(f"{self.__ep}: {e}") from e
+
+    def close(self):
+        with self.__lock:
+            self.__closed = True
+            idle, self.__idle = self.__idle, []
+        for conn, _ in idle:
+            self.__discard(conn)
+
+
+# ===============================================================================
@@ -0,0 +1,95 @@
+# ===============================================================================
+
+# Layers shouldn't be resolving to
+# ``spinal cord``, etc. nor to ``None``.
+# A SCKAN issue
+EXCLUDED_LAYERS = (
+    None,
+    'UBERON:0000010',      # peripheral nervous system
+    'UBERON:0000178',      # blood
+    'UBERON:0000468',      # multicellular organism
+    'UBERON:0001017',      # central nervous system
+    'UBERON:0001359',      # cerebrospinal fluid
+    'UBERON:0002318',      # spinal cord white matter
+    'UBERON:0003714',      # neural tissue
+    'UBERON:0005844',      # spinal cord segment
+    'UBERON:0016549',      # cns white matter
+)
+
+# ===============================================================================
+
+
+def filter_layer(connectivity):
+    # remove excluded layer terms from both nodes of an edge,
+    # returning the filtered edge or [] when a node is left empty
+    edge = []
+    for node in connectivity:
+        new_node = []
+        for terms in node:
+            if isinstance(terms, tuple):
+                terms = [t for t in terms if t not in EXCLUDED_LAYERS]
+                new_node += [tuple(terms)]
+            else:
+                terms = terms if terms not in EXCLUDED_LAYERS else []
+                new_node += [terms]
+        if len(new_node[0]) == 0 and len(new_node[1]) == 0:
+            return []
+        elif len(new_node[0]) == 0:
+            new_node = [new_node[1][0], tuple(list(new_node[1])[1:])]
+        edge += [tuple(new_node)]
+    return tuple(edge)
+
+# ===============================================================================
+
+
+def partial_order_connectivities(results, allow_loop=False):
+    # Rebuild the connectivity of each neuron from the rows of
+    # ``Query.PARTIAL_ORDER``. A partial order is a nested RDF list
+    # ``(node (child ...) (child ...))`` where a node is either a term or a
+    # blank node ``[layer region]``. Each list cell is one row, so the tree
+    # is rebuilt with a dictionary of cells and walked once with a stack.
+    cells, nodes, roots, labels = {}, {}, {}, {}
+    for rst in results:
+        first = rst["First"]
+        cells[rst["Cell"]["value"]] = (first["value"], rst["Rest"]["value"])
+        roots[rst["Neuron_IRI"]["value"]] = rst["List"]["value"]
+        if "Region" in rst and "Layer" in rst:
+            nodes[first["value"]] = (rst["Region"]["value"], (rst["Layer"]["value"],))
+        elif first["type"] == "uri":
+            nodes[first["value"]] = (first["value"], ())
+        for term, label in (("First", "First_Label"), ("Region", "Region_Label"), ("Layer", "Layer_Label")):
+            if term in rst and rst[term]["type"] == "uri":
+                labels[rst[term]["value"]] = rst[label]["value"] if label in rst else ""
+
+    def elements(lst):
+        if lst not in cells:
+            return [lst]
+        items = []
+        while lst in cells:
+            first, lst = cells[lst]
+            items += [first]
+        return items
+
+    connectivities = {}
+    for neuron, root in roots.items():
+        edges = []
+        # stack of (parent node, list of the subtree) still to visit
+        stack, visited = [(None, root)], set()
+        while len(stack) > 0:
+            parent, lst = stack.pop()
+            if lst in cells:
+                if lst in visited:
+                    continue
+                visited.add(lst)
+            items = elements(lst)
+            if (node := nodes.get(items[0])) is None:
+                continue
+            if parent is not None and (parent != node or allow_loop):
+                edge = filter_layer((parent, node))
+                if len(edge) > 0 and edge[0] != edge[1]:
+                    edges += [edge]
+            stack += [(node, child) for child in reversed(items[1:])]
+        connectivities[neuron] = edges
+    return connectivities, labels
+
+# ===============================================================================
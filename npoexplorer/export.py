@@ -0,0 +1,346 @@
+# ===============================================================================
+#
+# Streaming export of all SCKAN knowledge.
+#
+# Every neuron of every connectivity model is fetched in batches and written
+# as soon as its batch is retrieved, so memory is bounded by the batch size.
+# Both formats can resume an interrupted export.
+#
+# ===============================================================================
+
+import argparse
+import json
+import logging as log
+import os
+import sys
+
+from npoexplorer import ENDPOINT_BLAZEGRAPH, ENDPOINT_STARDOG, NPOExplorer
+from npoexplorer.backends import EndpointError
+
+# ===============================================================================
+
+BATCH_SIZE = 50
+
+FORMATS = ("jsonl", "parquet")
+
+ENDPOINTS = {
+    "stardog": ENDPOINT_STARDOG,
+    "blazegraph": ENDPOINT_BLAZEGRAPH,
+}
+
+NODE_ROLES = {
+    "soma": "soma",
+    "axons": "axon",
+    "dendrites": "dendrite",
+}
+
+# ===============================================================================
+
+
+class ExportError(Exception):
+    pass
+
+# ===============================================================================
+
+
+def _flatten(values):
+    # references and taxons are lists of single element lists
+    return [v[0] if isinstance(v, (list, tuple)) else v for v in values]
+
+
+def _node_terms(knowledge):
+    for key in NODE_ROLES:
+        for node in knowledge.get(key, []):
+            yield node[0]
+            yield from node[1]
+    for edge in knowledge.get("connectivity", []):
+        for node in edge:
+            yield node[0]
+            yield from node[1]
+
+
+def _write_metadata(path, metadata):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(metadata, f)
+    os.replace(tmp_path, path)
+
+
+def _check_metadata(path, metadata):
+    # records of different NPO or SimpleSCKAN builds must not be mixed
+    try:
+        with open(path, encoding="utf-8") as f:
+            exported = json.load(f)
+    except (OSError, ValueError):
+        exported = None
+    if exported != metadata:
+        raise ExportError(
+            f"Cannot resume an export made from {exported} with {metadata}, "
+            "restart it without resuming"
+        )
+
+# ===============================================================================
+
+
+class JsonlWriter:
+    # The versions the records were exported from are kept in a
+    # ``<path>.metadata.json`` sidecar.
+
+    def __init__(self, path, metadata, resume=True) -> None:
+        self.__path = path
+        self.__completed = set()
+        metadata_path = f"{path}.metadata.json"
+        if resume and os.path.exists(path):
+            _check_metadata(metadata_path, metadata)
+            self.__recover()
+            self.__file = open(path, "a", encoding="utf-8")
+        else:
+            _write_metadata(metadata_path, metadata)
+            self.__file = open(path, "w", encoding="utf-8")
+
+    def __recover(self):
+        # keep complete records and drop a record cut short by an interruption
+        valid_size = 0
+        with open(self.__path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                self.__completed.add(record["id"])
+                valid_size += len(line)
+        with open(self.__path, "r+b") as f:
+            f.truncate(valid_size)
+
+    def completed(self):
+        return self.__completed
+
+    def write(self, records):
+        for record in records:
+            self.__file.write(json.dumps(record) + "\n")
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+
+    def close(self):
+        self.__file.close()
+
+
+class ParquetWriter:
+    # Writes a directory with ``neurons``, ``nodes`` and ``edges`` tables,
+    # each batch being a ``part-NNNNN.parquet`` file in every table. The
+    # neurons part is written last, so it marks a batch as complete. The
+    # versions the tables were exported from are kept in ``metadata.json``.
+
+    TABLES = ("edges", "nodes", "neurons")
+
+    def __init__(self, path, metadata, resume=True) -> None:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet export requires pyarrow: pip install npoexplorer[parquet]") from None
+        self.__pa, self.__pq = pa, pq
+        strings = pa.list_(pa.string())
+        self.__schemas = {
+            "edges": pa.schema([
+                ("neuron", pa.string()),
+                ("source", pa.string()),
+                ("source_layers", strings),
+                ("source_label", pa.string()),
+                ("target", pa.string()),
+                ("target_layers", strings),
+                ("target_label", pa.string()),
+            ]),
+            "nodes": pa.schema([
+                ("neuron", pa.string()),
+                ("role", pa.string()),
+                ("node", pa.string()),
+                ("layers", strings),
+                ("label", pa.string()),
+            ]),
+            "neurons": pa.schema([
+                ("id", pa.string()),
+                ("label", pa.string()),
+                ("models", strings),
+                ("phenotypes", strings),
+                ("references", strings),
+                ("taxon", strings),
+                ("errors", strings),
+            ]),
+        }
+        self.__path = path
+        self.__completed = set()
+        self.__part = 0
+        for table in ParquetWriter.TABLES:
+            os.makedirs(os.path.join(path, table), exist_ok=True)
+        self.__recover(resume, metadata)
+
+    def __parts(self, table):
+        return sorted(
+            name for name in os.listdir(os.path.join(self.__path, table))
+            if name.startswith("part-") and name.endswith(".parquet")
+        )
+
+    def __recover(self, resume, metadata):
+        completed_parts = set(self.__parts("neurons")) if resume else set()
+        metadata_path = os.path.join(self.__path, "metadata.json")
+        if len(completed_parts) > 0:
+            _check_metadata(metadata_path, metadata)
+        else:
+            _write_metadata(metadata_path, metadata)
+        for table in ParquetWriter.TABLES:
+            for name in self.__parts(table):
+                if name not in completed_parts:
+                    os.remove(os.path.join(self.__path, table, name))
+        for name in completed_parts:
+            ids = self.__pq.read_table(
+                os.path.join(self.__path, "neurons", name), columns=["id"]
+            ).column("id")
+            self.__completed.update(ids.to_pylist())
+            self.__part = max(self.__part, int(name[5:-8]) + 1)
+
+    def completed(self):
+        return self.__completed
+
+    def __write_table(self, table, rows):
+        name = f"part-{self.__part:05d}.parquet"
+        tmp_path = os.path.join(self.__path, table, f".{name}.tmp")
+        self.__pq.write_table(
+            self.__pa.Table.from_pylist(rows, schema=self.__schemas[table]), tmp_path
+        )
+        os.replace(tmp_path, os.path.join(self.__path, table, name))
+
+    def write(self, records):
+        edges, nodes, neurons = [], [], []
+        for record in records:
+            labels = record["labels"]
+            for source, target in record["connectivity"]:
+                edges += [{
+                    "neuron": record["id"],
+                    "source": source[0],
+                    "source_layers": list(source[1]),
+                    "source_label": labels.get(source[0], ""),
+                    "target": target[0],
+                    "target_layers": list(target[1]),
+                    "target_label": labels.get(target[0], ""),
+                }]
+            for key, role in NODE_ROLES.items():
+                for node in record[key]:
+                    nodes += [{
+                        "neuron": record["id"],
+                        "role": role,
+                        "node": node[0],
+                        "layers": list(node[1]),
+                        "label": labels.get(node[0], ""),
+                    }]
+            neurons += [{
+                "id": record["id"],
+                "label": record["label"],
+                "models": record["models"],
+                "phenotypes": record["phenotypes"],
+                "references": record["references"],
+                "taxon": record["taxon"],
+                "errors": record["errors"],
+            }]
+        self.__write_table("edges", edges)
+        self.__write_table("nodes", nodes)
+        self.__write_table("neurons", neurons)
+        self.__part += 1
+
+    def close(self):
+        pass
+
+# ===============================================================================
+
+
+def export(explorer, path, format="jsonl", batch_size=BATCH_SIZE, resume=True, progress=None):
+    if format not in FORMATS:
+        raise ValueError(f"Unknown export format {format}, expected one of {FORMATS}")
+
+    # neurons of all connectivity models, with the models they belong to
+    neuron_models = {}
+    for model in explorer.connectivity_models():
+        knowledge = explorer.entity_knowledge(model)
+        if len(knowledge.get("errors", [])) > 0:
+            # exporting without the model's neurons would silently lose them
+            raise EndpointError(
+                f"Cannot retrieve neurons of {model}: {'; '.join(knowledge['errors'])}"
+            )
+        for path_ in knowledge.get("paths", []):
+            neuron_models.setdefault(path_["id"], []).append(model)
+
+    metadata = explorer.metadata()
+    writer = (JsonlWriter if format == "jsonl" else ParquetWriter)(
+        path, metadata, resume=resume
+    )
+    try:
+        pending = [n for n in neuron_models if n not in writer.completed()]
+        total, done = len(neuron_models), len(neuron_models) - len(pending)
+        if done > 0:
+            log.info(f"Resuming export with {done} of {total} neurons already exported")
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            records = []
+            for neuron, knowledge in explorer.entities_knowledge(batch).items():
+                records += [{
+                    "id": neuron,
+                    "label": knowledge.get("label", neuron),
+                    "models": neuron_models[neuron],
+                    "soma": knowledge.get("soma", []),
+                    "axons": knowledge.get("axons", []),
+                    "dendrites": knowledge.get("dendrites", []),
+                    "connectivity": knowledge.get("connectivity", []),
+                    "phenotypes": knowledge.get("phenotypes", []),
+                    "references": _flatten(knowledge.get("references", [])),
+                    "taxon": _flatten(knowledge.get("taxon", [])),
+                    "errors": knowledge.get("errors", []),
+                    "labels": {
+                        term: explorer.label(term) for term in _node_terms(knowledge)
+                    },
+                }]
+            writer.write(records)
+            done += len(batch)
+            if progress is not None:
+                progress(done, total)
+    finally:
+        writer.close()
+    return done
+
+# ===============================================================================
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export all SCKAN knowledge from NPO.")
+    parser.add_argument("output", help="JSONL file, or directory for Parquet tables")
+    parser.add_argument("--format", choices=FORMATS, default="jsonl")
+    parser.add_argument("--endpoint", choices=list(ENDPOINTS), default="stardog")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--no-resume", action="store_true", help="Restart instead of resuming")
+    parser.add_argument("--allow-loop", action="store_true")
+    args = parser.parse_args()
+
+    log.basicConfig(level=log.INFO)
+
+    def report(done, total):
+        print(f"\rExported {done}/{total} neurons", end="", file=sys.stderr, flush=True)
+
+    explorer = NPOExplorer(allow_loop=args.allow_loop, endpoint=ENDPOINTS[args.endpoint])
+    try:
+        export(
+            explorer, args.output, format=args.format, batch_size=args.batch_size,
+            resume=not args.no_resume, progress=report,
+        )
+    except ExportError as e:
+        log.error(e)
+        sys.exit(1)
+    finally:
+        print(file=sys.stderr)
+        explorer.close()
+
+
+if __name__ == "__main__":
+    main()
+
+# ===============================================================================
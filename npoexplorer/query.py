@@ -62,6 +62,11 @@ class Query:
         + "\n"
     )
 
+    @staticmethod
+    def values(entities) -> str:
+        # rows of a single variable VALUES block
+        return " ".join(f"({entity})" for entity in entities)
+
     MODELS = """
         SELECT DISTINCT ?Model_ID WHERE{
             ?Model_ID rdfs:subClassOf ilxtr:NeuronEBM .
@@ -102,7 +107,7 @@ class Query:
         SELECT * WHERE {{
         {{
             SELECT DISTINCT ?Neuron_IRI ?Predicate ?Object ?Object_Label {{
-                VALUES(?Neuron_IRI){{({entity})}}
+                VALUES(?Neuron_IRI){{{values}}}
                 ?Neuron_IRI ?Predicate ?Object.
                 OPTIONAL{{?Object rdfs:label ?Object_Label}}
             }}
@@ -110,7 +115,7 @@ class Query:
         UNION
         {{
             SELECT DISTINCT ?Neuron_IRI ?Predicate ?Object ?Object_Label {{
-                VALUES(?Neuron_IRI){{({entity})}}
+                VALUES(?Neuron_IRI){{{values}}}
                 ?Neuron_IRI ?Predicate ?Phenotype.
                 ?Phenotype rdfs:subClassOf ?Object.
                 OPTIONAL{{?Object rdfs:label ?Object_Label}}
@@ -126,18 +131,25 @@ class Query:
         }}
     """
 
-    CONNECTIVITY = """
-        SELECT ?Layer ?Layer_Label ?Region ?Region_Label (COUNT(?d) AS ?Count) WHERE{{
-            VALUES(?Neuron_IRI){{({entity})}}
-            ?Neuron_IRI ilxtr:neuronPartialOrder ?o.
-            ?o (rdf:first|rdf:rest)* ?d .
-            ?d (rdf:first|rdf:rest)* ?e .
-            ?e ?Layer ?Region .
-            OPTIONAL{{?Layer rdfs:label ?Layer_Label}}
-            OPTIONAL{{?Region rdfs:label ?Region_Label}}
-            FILTER (REGEX(STR(?Region), STR(ILX:)) || REGEX(STR(?Region), STR(UBERON:)))
-            FILTER (?Layer=rdf:first || REGEX(STR(?Layer), STR(ILX:)) || REGEX(STR(?Layer), STR(UBERON:)))
-        }} GROUP BY ?Region ?Layer ?Region_Label ?Layer_Label ?e
+    # Query: the list cells of each neuron's partial order, one row per cell,
+    # with the layer and region of blank nodes ``[layer region]``
+    PARTIAL_ORDER = """
+        SELECT DISTINCT ?Neuron_IRI ?List ?Cell ?First ?Rest ?First_Label
+                        ?Layer ?Layer_Label ?Region ?Region_Label WHERE{{
+            VALUES(?Neuron_IRI){{{values}}}
+            ?Neuron_IRI ilxtr:neuronPartialOrder ?List .
+            ?List (rdf:first|rdf:rest)* ?Cell .
+            ?Cell rdf:first ?First ;
+                  rdf:rest ?Rest .
+            OPTIONAL{{?First rdfs:label ?First_Label}}
+            OPTIONAL{{
+                ?First ?Layer ?Region .
+                FILTER (isBlank(?First))
+                FILTER (STRSTARTS(STR(?Layer), STR(ILX:)) || STRSTARTS(STR(?Layer), STR(UBERON:)))
+                OPTIONAL{{?Layer rdfs:label ?Layer_Label}}
+                OPTIONAL{{?Region rdfs:label ?Region_Label}}
+            }}
+        }}
     """
 
     DB_VERSION = """